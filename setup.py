@@ -1,12 +1,22 @@
+import functools
+import os
+
 from setuptools import setup, find_packages
 
-def read_recursive_requirements(path):
+@functools.lru_cache(maxsize=None)
+def _read_requirements(path):
+    requirements = []
     with open(path) as f:
         for line in f:
             if line.startswith('-r'):
-                yield from read_recursive_requirements(line[3:].strip())
+                included = os.path.join(os.path.dirname(path), line[3:].strip())
+                requirements.extend(_read_requirements(os.path.realpath(included)))
             else:
-                yield line.strip()
+                requirements.append(line.strip())
+    return tuple(requirements)
+
+def read_recursive_requirements(path):
+    return _read_requirements(os.path.realpath(path))
 
 setup(
     name='tg',
@@ -15,7 +25,14 @@ setup(
     author='Alexey Leshchenko',
     author_email='leshchenko@google.com',
     packages=find_packages(),
-    install_requires=["pyrogram", "supabase", "icontract", "cloudpickle"],
-    extras_require={"full": ["pandas"]},
+    python_requires='>=3.11',
+    install_requires=["pyrogram", "supabase", "icontract"],
+    extras_require={
+        "full": ["numpy", "pandas>=2.0"],
+        "speedups": [
+            "uvloop; sys_platform != 'win32'",
+            "winloop; sys_platform == 'win32'",
+        ],
+    },
     include_package_data=True,
 )
@@ -8,6 +8,7 @@ class Account:
     def __init__(self, started=False, raises: Exception = None):
         self.started = started
         self.raises = raises
+        self.filename = "account.session"
 
     async def start(self, revalidate=False):
         if self.raises:
@@ -18,22 +19,28 @@ class Account:
     async def stop(self):
         self.started = False
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_fs():
     fs = MagicMock()
     fs.exists.return_value = False
-    fs.touch = AsyncMock()
-    fs.rm = AsyncMock()
+    fs.touch = MagicMock()
+    fs.rm = MagicMock()
     return fs
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def account_dict():
     return {
         "account1": Account(raises = AccountStartFailed),
         "account2": Account(),
     }
 
-@pytest.mark.asyncio
+@pytest.fixture(autouse=True)
+def reset_state(mock_fs, account_dict):
+    mock_fs.reset_mock()
+    mock_fs.exists.return_value = False
+    for account in account_dict.values():
+        account.started = False
+
 @pytest.mark.parametrize(
     "invalid, expected_exception, test_id",
     [
@@ -57,7 +64,6 @@ async def test_start_sessions(invalid, expected_exception, test_id, account_dict
     for account in account_dict.values():
         assert account.started == (account.raises is None)
 
-@pytest.mark.asyncio
 @pytest.mark.parametrize(
     "fs_exists, expected_exception, test_id",
     [
@@ -81,7 +87,6 @@ async def test_session_context_manager(fs_exists, expected_exception, test_id, a
         for account in account_dict.values():
             assert not account.started
 
-@pytest.mark.asyncio
 @pytest.mark.parametrize(
     "started, test_id",
     [
@@ -101,3 +106,27 @@ async def test_close_sessions(started, test_id, account_dict, mock_fs):
     # Assert
     for account in account_dict.values():
         assert not account.started
+
+async def test_save_session_string_skips_unchanged(mock_fs):
+    from tg.account import Account as RealAccount
+
+    account = RealAccount(mock_fs, "account1")
+    account.app = MagicMock()
+    account.app.export_session_string = AsyncMock(return_value="session")
+
+    # Act
+    await account.save_session_string()
+    await account.save_session_string()
+
+    # Assert
+    mock_fs.pipe_file.assert_called_once_with("account1.session", b"session")
+
+
+async def test_start_sessions_prefetches_session_files(account_dict, mock_fs):
+    collection = AccountCollection(accounts=account_dict, fs=mock_fs, invalid="ignore")
+
+    # Act
+    await collection.start_sessions()
+
+    # Assert
+    mock_fs.get_many.assert_called_once_with(["account.session", "account.session"])
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from tg.chat_cache import CACHE_FILE, LOG_FILE, ChatCache
+
+
+class LocalFileSystem:
+    def __init__(self, root):
+        self.root = root
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.root, path))
+
+    def open(self, path, mode="r"):
+        return open(os.path.join(self.root, path), mode)
+
+    def rm(self, path):
+        os.remove(os.path.join(self.root, path))
+
+    def mv(self, path1, path2):
+        os.replace(os.path.join(self.root, path1), os.path.join(self.root, path2))
+
+
+@pytest.fixture
+def fs(tmp_path):
+    return LocalFileSystem(tmp_path)
+
+
+def test_save_and_load_roundtrip(fs):
+    # Arrange
+    cache = ChatCache(fs)
+    for i in range(8):
+        cache[f"Channel{i}"] = i
+
+    # Act
+    cache.save()  # the first save writes the full cache
+    cache["channel0"] = "changed"
+    cache.save()  # small changes are appended to the log
+
+    loaded = ChatCache(fs)
+    loaded.load()
+
+    # Assert
+    assert fs.exists(LOG_FILE)
+    assert loaded.cache == {f"@channel{i}": i for i in range(1, 8)} | {
+        "@channel0": "changed"
+    }
+
+
+def test_save_compacts_large_log(fs):
+    # Arrange
+    cache = ChatCache(fs)
+    for i in range(8):
+        cache[f"channel{i}"] = i
+    cache.save()
+
+    # Act
+    for i in range(4):
+        cache[f"channel{i}"] = -i
+    cache.save()
+
+    loaded = ChatCache(fs)
+    loaded.load()
+
+    # Assert
+    assert fs.exists(CACHE_FILE)
+    assert not fs.exists(LOG_FILE)
+    assert loaded.cache["@channel3"] == -3
+
+
+def test_save_skips_unchanged(fs):
+    cache = ChatCache(fs)
+
+    # Act
+    cache.save()
+
+    # Assert
+    assert not fs.exists(CACHE_FILE)
@@ -0,0 +1,16 @@
+import asyncio
+
+from tg.utils import fast_event_loop_factory
+
+
+def test_fast_event_loop_factory_runs_a_coroutine():
+    async def main():
+        await asyncio.sleep(0)
+        return 42
+
+    # Act
+    with asyncio.Runner(loop_factory=fast_event_loop_factory()) as runner:
+        result = runner.run(main())
+
+    # Assert
+    assert result == 42
@@ -0,0 +1,30 @@
+import pytest
+
+from tg.utils import get_nicknames
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("", set()),
+        (None, set()),
+        ("no nicknames here", set()),
+        ("hi @Alice_1", {"@alice_1"}),
+        ("see https://t.me/BobBob/12", {"@bobbob"}),
+        ("@abc is too short", set()),
+        ("@Alice_1 and https://t.me/alice_1", {"@alice_1"}),
+        ("@first_one, @second_one", {"@first_one", "@second_one"}),
+    ],
+    ids=[
+        "empty",
+        "none",
+        "no-nicknames",
+        "at-sign",
+        "link",
+        "too-short",
+        "duplicate",
+        "several",
+    ],
+)
+def test_get_nicknames(text, expected):
+    assert get_nicknames(text) == expected
@@ -0,0 +1,316 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pyrogram
+import pytest
+
+from tg.account import AvailableAccounts, Scanner
+from tg.chat_cache import ChatCache
+
+
+@pytest.fixture
+def scanner():
+    scanner = Scanner(MagicMock(), phones=["account1"], chat_cache=False)
+    scanner.available_accs.put_nowait(scanner["account1"])
+    return scanner
+
+
+async def test_available_accounts_get_waits_for_put():
+    # Arrange
+    available = AvailableAccounts()
+    getter = asyncio.create_task(available.get())
+    await asyncio.sleep(0)
+
+    # Act
+    available.put_nowait("account1")
+    available.put_nowait("account2")
+
+    # Assert
+    assert await getter == "account1"
+    assert available.qsize() == 1
+    assert await available.get() == "account2"
+    assert available.empty()
+
+
+async def test_get_acc_returns_account(scanner):
+    # Act
+    async with scanner.get_acc() as acc:
+        assert scanner.available_accs.empty()
+
+    # Assert
+    assert acc is scanner["account1"]
+    assert scanner.available_accs.qsize() == 1
+
+
+async def test_get_acc_returns_account_on_error(scanner):
+    # Act
+    with pytest.raises(ValueError):
+        async with scanner.get_acc():
+            raise ValueError
+
+    # Assert
+    assert scanner.available_accs.qsize() == 1
+
+
+async def test_get_acc_sends_account_to_flood_wait(scanner):
+    scanner.flood_wait = AsyncMock()
+
+    # Act
+    with pytest.raises(pyrogram.errors.FloodWait):
+        async with scanner.get_acc() as acc:
+            raise pyrogram.errors.FloodWait(value=5)
+    await asyncio.sleep(0)
+
+    # Assert
+    scanner.flood_wait.assert_awaited_once_with(acc, 5)
+    assert scanner.available_accs.empty()
+
+
+async def test_process_command_retries_after_flood_wait(scanner):
+    # skip the actual waiting and make the account available again right away
+    scanner.flood_wait = AsyncMock(
+        side_effect=lambda acc, timeout: scanner.available_accs.put_nowait(acc)
+    )
+    app = scanner["account1"].app = MagicMock()
+    app.get_chat = AsyncMock(side_effect=[pyrogram.errors.FloodWait(value=5), "chat"])
+
+    # Act
+    result = await scanner.process_command("get_chat", "@channel")
+
+    # Assert
+    assert result == "chat"
+    assert app.get_chat.await_count == 2
+
+
+async def test_get_chat_members_count_uses_cached_chat(scanner):
+    scanner.chat_cache = ChatCache(MagicMock())
+    app = scanner["account1"].app = MagicMock()
+    app.get_chat = AsyncMock(return_value=MagicMock(members_count=42))
+
+    # Act
+    chat = await scanner.get_chat("Channel")
+    members_count = await scanner.get_chat_members_count("@channel")
+
+    # Assert
+    assert chat.members_count == members_count == 42
+    app.get_chat.assert_awaited_once_with("Channel")
+    app.get_chat_members_count.assert_not_called()
+
+
+async def test_min_wait_tracks_earliest_flood_wait():
+    scanner = Scanner(MagicMock(), phones=["account1", "account2"], chat_cache=False)
+    account1, account2 = scanner["account1"], scanner["account2"]
+    assert scanner.min_wait() is None
+
+    # Act
+    tasks = [
+        asyncio.create_task(scanner.flood_wait(account1, 100)),
+        asyncio.create_task(scanner.flood_wait(account2, 10)),
+    ]
+    await asyncio.sleep(0)
+
+    # Assert
+    assert 9 < scanner.min_wait() <= 10
+
+    tasks[1].cancel()
+    await asyncio.sleep(0)
+    assert 99 < scanner.min_wait() <= 100
+
+    tasks[0].cancel()
+
+
+async def test_get_chat_dedupes_concurrent_requests(scanner):
+    scanner.chat_cache = ChatCache(MagicMock())
+    app = scanner["account1"].app = MagicMock()
+    app.get_chat = AsyncMock(return_value=MagicMock(members_count=42))
+
+    # Act
+    chats = await asyncio.gather(
+        scanner.get_chat("channel"), scanner.get_chat("@Channel")
+    )
+
+    # Assert
+    assert chats[0] is chats[1]
+    app.get_chat.assert_awaited_once_with("channel")
+    assert not scanner.inflight
+
+
+async def test_nested_sessions_start_once(scanner):
+    scanner.fs.exists.return_value = False
+    scanner.start_sessions = AsyncMock()
+    scanner.close_sessions = AsyncMock()
+
+    # Act
+    async with scanner.session():
+        async with scanner.session():
+            pass
+        scanner.close_sessions.assert_not_called()
+
+    # Assert
+    scanner.start_sessions.assert_awaited_once()
+    scanner.close_sessions.assert_awaited_once()
+    assert scanner.session_depth == 0
+
+
+async def test_overlapping_sessions_close_after_the_last_one(scanner):
+    scanner.fs.exists.return_value = False
+
+    async def start_sessions():
+        await asyncio.sleep(0.01)  # the second session waits for the startup
+
+    scanner.start_sessions = AsyncMock(side_effect=start_sessions)
+    scanner.close_sessions = AsyncMock()
+    first_left = asyncio.Event()
+    first_pbar, second_pbar = MagicMock(), MagicMock()
+
+    async def first():
+        async with scanner.session(first_pbar):
+            await asyncio.sleep(0)
+        first_left.set()
+
+    async def second():
+        async with scanner.session(second_pbar):
+            await first_left.wait()
+            scanner.close_sessions.assert_not_called()
+            assert scanner.pbar is first_pbar
+
+    # Act
+    await asyncio.gather(first(), second())
+
+    # Assert
+    scanner.start_sessions.assert_awaited_once()
+    scanner.close_sessions.assert_awaited_once()
+    assert scanner.session_depth == 0
+    assert scanner.pbar is None
+
+
+class FakePbar:
+    def __init__(self, postfix=""):
+        self.postfix = postfix
+
+    def set_postfix_str(self, postfix):
+        self.postfix = postfix
+
+
+async def test_flood_waits_keep_the_pbar_postfix(scanner):
+    scanner.pbar = FakePbar("@channel")
+    acc = scanner["account1"]
+
+    # Act
+    flood_wait = asyncio.create_task(scanner.flood_wait(acc, 0.01))
+    await asyncio.sleep(0)
+    during = scanner.pbar.postfix
+    await flood_wait
+
+    # Assert
+    assert during == "@channel, <Account account1>: flood_wait 0.01 secs"
+    assert scanner.pbar.postfix == "@channel"
+
+
+async def test_flood_waits_follow_a_changed_postfix(scanner):
+    scanner.pbar = FakePbar("@first")
+    acc = scanner["account1"]
+    flood_wait = asyncio.create_task(scanner.flood_wait(acc, 0.01))
+    await asyncio.sleep(0)
+
+    # Act
+    scanner.pbar.set_postfix_str("@second")
+    await flood_wait
+
+    # Assert
+    assert scanner.pbar.postfix == "@second"
+
+
+async def test_get_chat_history_releases_account_between_pages(scanner):
+    messages = [MagicMock(id=i) for i in range(250, 0, -1)]
+
+    async def get_chat_history(chat_id, limit, offset_id):
+        assert scanner.available_accs.empty()
+        older = [msg for msg in messages if not offset_id or msg.id < offset_id]
+        for msg in older[:limit]:
+            yield msg
+
+    scanner["account1"].app = MagicMock(get_chat_history=get_chat_history)
+
+    # Act
+    result = []
+    async for msg in scanner.get_chat_history("@channel", limit=220):
+        assert scanner.available_accs.qsize() == 1
+        result.append(msg)
+
+    # Assert
+    assert result == messages[:220]
+
+
+@pytest.mark.parametrize("limit", [None, 0], ids=["none", "zero"])
+async def test_get_chat_history_stops_after_a_short_page(scanner, limit):
+    messages = [MagicMock(id=i) for i in range(250, 0, -1)]
+    offsets = []
+
+    async def get_chat_history(chat_id, limit, offset_id):
+        offsets.append(offset_id)
+        older = [msg for msg in messages if not offset_id or msg.id < offset_id]
+        for msg in older[:limit]:
+            yield msg
+
+    scanner["account1"].app = MagicMock(get_chat_history=get_chat_history)
+
+    # Act
+    result = [msg async for msg in scanner.get_chat_history("@channel", limit=limit)]
+
+    # Assert
+    assert result == messages
+    assert offsets == [0, 151, 51]
+
+
+def test_scanner_can_be_reused_with_another_loop():
+    scanner = Scanner(MagicMock(), phones=["account1"], chat_cache=False)
+    scanner.fs.exists.return_value = False
+    acc = scanner["account1"]
+
+    async def start(revalidate):
+        acc.started = True
+
+    async def get_discussion_replies_count(chat_id, msg_id):
+        await asyncio.sleep(0)  # keeps the account busy, so the others wait
+        return 1
+
+    acc.start = start
+    acc.stop = AsyncMock()
+    acc.app = MagicMock(get_discussion_replies_count=get_discussion_replies_count)
+
+    async def scan():
+        async with scanner.session():
+            return await asyncio.gather(
+                *[scanner.get_discussion_replies_count("@a", i) for i in range(3)]
+            )
+
+    # Act & Assert
+    assert asyncio.run(scan()) == [1, 1, 1]
+    assert asyncio.run(scan()) == [1, 1, 1]
+
+
+def test_overlapping_sessions_in_another_loop():
+    scanner = Scanner(MagicMock(), phones=["account1"], chat_cache=False)
+    scanner.fs.exists.return_value = False
+
+    async def start_sessions():
+        await asyncio.sleep(0)  # the other session contends for the lock
+
+    scanner.start_sessions = AsyncMock(side_effect=start_sessions)
+    scanner.close_sessions = AsyncMock()
+
+    async def enter():
+        async with scanner.session():
+            await asyncio.sleep(0)
+
+    async def overlap():
+        await asyncio.gather(enter(), enter())
+
+    # Act
+    asyncio.run(overlap())
+    asyncio.run(overlap())
+
+    # Assert
+    assert scanner.start_sessions.await_count == 2
+    assert scanner.close_sessions.await_count == 2
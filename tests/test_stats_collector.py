@@ -0,0 +1,200 @@
+import asyncio
+import datetime as dt
+import math
+from unittest.mock import AsyncMock, MagicMock
+
+import pandas as pd
+import pytest
+
+from tg.stats import Channel, StatsCollector, shorten, to_columns
+
+
+@pytest.fixture
+def collector():
+    collector = StatsCollector(MagicMock(accounts={}))
+    collector.msgs_df = pd.DataFrame(
+        {
+            "username": ["@a", "@a", "@b"],
+            "reach": [10, 11, 0],
+            "likes": [1, 2, 3],
+            "replies": [1, 0, 0],
+            "forwards": [0, 0, 1],
+        }
+    )
+    collector.channels_df = pd.DataFrame(
+        {"username": ["@a", "@b"], "subscribers": [100, 200]}
+    )
+    return collector
+
+
+def test_calc_msg_popularity(collector):
+    # Act
+    collector.calc_msg_popularity()
+
+    # Assert
+    popularity = collector.msgs_df.popularity.tolist()
+    assert popularity[:2] == [0.2, 2 / 11]
+    assert math.isnan(popularity[2])
+
+
+def test_collect_stats_to_single_df(collector):
+    # Act
+    collector.collect_stats_to_single_df()
+
+    # Assert
+    assert collector.stats.to_dict("records") == [
+        {"username": "@a", "reach": 10, "subscribers": 100},
+        {"username": "@b", "reach": 0, "subscribers": 200},
+    ]
+
+
+@pytest.mark.parametrize(
+    "rows, expected",
+    [
+        ([], {"username": (), "subscribers": ()}),
+        (
+            [Channel("@a", 1), Channel("@b", 2)],
+            {"username": ("@a", "@b"), "subscribers": (1, 2)},
+        ),
+    ],
+    ids=["empty", "two-rows"],
+)
+def test_to_columns(rows, expected):
+    assert to_columns(rows, Channel._fields) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("short", "short"),
+        ("я" * 201, "я" * 200 + "..."),
+        (None, None),
+    ],
+    ids=["short", "long-cyrillic", "none"],
+)
+def test_shorten(text, expected):
+    assert shorten(text) == expected
+
+
+async def test_parallel_scan(collector):
+    collector.collect_msg_stats = AsyncMock(side_effect=lambda c: [c, c])
+    collector.collect_channel_stats = AsyncMock(side_effect=lambda c: c.upper())
+
+    # Act
+    msg_stats, channel_stats = await collector.parallel_scan(["@a", "@b"])
+
+    # Assert
+    assert sorted(msg_stats) == ["@a", "@a", "@b", "@b"]
+    assert channel_stats == ["@A", "@B"]
+
+
+async def test_parallel_scan_is_bounded():
+    collector = StatsCollector(MagicMock(accounts={}), concurrency=2)
+    running = 0
+    max_running = 0
+
+    async def collect(channel):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0)
+        running -= 1
+        return [channel]
+
+    collector.collect_msg_stats = collect
+    collector.collect_channel_stats = AsyncMock(side_effect=lambda c: c)
+
+    # Act
+    await collector.parallel_scan([f"@{i}" for i in range(10)])
+
+    # Assert
+    assert max_running == 2
+
+
+def history_scanner(dates):
+    msgs = [
+        MagicMock(id=i, reactions=None, text=str(i), views=i, forwards=0, date=date)
+        for i, date in enumerate(dates)
+    ]
+
+    async def get_chat_history(channel, min_date):
+        for msg in msgs:
+            yield msg
+
+    return MagicMock(
+        accounts={},
+        get_chat_history=get_chat_history,
+        get_discussion_replies_count=AsyncMock(side_effect=lambda c, msg_id: msg_id),
+    )
+
+
+async def test_collect_msg_stats_keeps_order():
+    scanner = history_scanner([dt.datetime.now()] * 100)
+
+    # Act
+    result = await StatsCollector(scanner).collect_msg_stats("@a")
+
+    # Assert
+    assert [msg.replies for msg in result] == list(range(100))
+    assert [msg.reach for msg in result] == list(range(100))
+
+
+def test_calc_msg_popularity_empty(collector):
+    collector.msgs_df = collector.msgs_df.iloc[:0]
+
+    # Act
+    collector.calc_msg_popularity()
+
+    # Assert
+    assert collector.msgs_df.popularity.empty
+
+
+async def test_collect_msg_stats_caches_old_replies():
+    now = dt.datetime.now()
+    scanner = history_scanner([now, now - dt.timedelta(days=30)])
+    collector = StatsCollector(scanner)
+    await collector.collect_msg_stats("@a")
+
+    # Act
+    await collector.collect_msg_stats("@a")
+
+    # Assert
+    msg_ids = [
+        call.args[1] for call in scanner.get_discussion_replies_count.call_args_list
+    ]
+    assert msg_ids == [0, 1, 0]
+
+
+async def test_replies_cache_keeps_only_the_last_scan():
+    old = dt.datetime.now() - dt.timedelta(days=30)
+    scanner = history_scanner([old, old])
+    collector = StatsCollector(scanner)
+    await collector.collect_msg_stats("@a")
+    last_msg = MagicMock(id=1, reactions=None, text="", views=0, forwards=0, date=old)
+
+    async def get_chat_history(channel, min_date):
+        yield last_msg
+
+    scanner.get_chat_history = get_chat_history
+
+    # Act
+    await collector.collect_msg_stats("@a")
+
+    # Assert
+    assert collector.replies_cache == {"@a": {1: 1}}
+
+
+def test_collector_can_be_reused_with_another_loop():
+    scanner = history_scanner([dt.datetime.now()] * 3)
+    collector = StatsCollector(scanner, concurrency=1)
+
+    async def scan():
+        return await collector.parallel_scan(["@a", "@b"])
+
+    collector.collect_channel_stats = AsyncMock(side_effect=lambda c: c)
+
+    # Act & Assert
+    for _ in range(2):
+        msg_stats, channel_stats = asyncio.run(scan())
+        assert len(msg_stats) == 6
+        assert channel_stats == ["@a", "@b"]
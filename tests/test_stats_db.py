@@ -0,0 +1,124 @@
+import datetime as dt
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+from tg.stats import StatsDatabase
+from tg.stats.stats_db import INSERT_CHUNK_SIZE, MSGS_DF_COLS, STATS_DF_COLS
+
+
+def test_save_new_stats_to_db_inserts_in_chunks():
+    client = MagicMock()
+    stats_db = StatsDatabase(client, "channels", "stats", "msgs")
+    n = INSERT_CHUNK_SIZE * 2 + 1
+    stats_df = pd.DataFrame(
+        {"username": ["@a"] * n, "reach": [1] * n, "subscribers": [2] * n}
+    )
+
+    # Act
+    stats_db.save_new_stats_to_db(stats_df)
+
+    # Assert
+    chunks = [call.args[0] for call in client.table("stats").insert.call_args_list]
+    assert [len(chunk) for chunk in chunks] == [INSERT_CHUNK_SIZE, INSERT_CHUNK_SIZE, 1]
+
+
+def test_save_msgs_leaves_dataframe_untouched():
+    client = MagicMock()
+    stats_db = StatsDatabase(client, "channels", "stats", "msgs")
+    msgs_df = pd.DataFrame(
+        {
+            "username": ["@a"],
+            "link": ["https://t.me/a/1"],
+            "reach": [1],
+            "likes": [0],
+            "replies": [0],
+            "forwards": [0],
+            "datetime": [pd.Timestamp("2024-01-01 10:00")],
+            "text": ["text"],
+        }
+    )
+
+    # Act
+    stats_db.save_msgs(msgs_df)
+
+    # Assert
+    [data] = client.table("msgs").insert.call_args.args
+    assert data[0]["datetime"] == "2024-01-01 10:00:00"
+    assert pd.api.types.is_datetime64_dtype(msgs_df["datetime"])
+
+
+def test_load_data_on_empty_tables():
+    client = MagicMock()
+    select = client.table.return_value.select.return_value
+    select.execute.return_value.data = []
+    select.order.return_value.execute.return_value.data = []
+    select.order.return_value.limit.return_value.execute.return_value.data = []
+    stats_db = StatsDatabase(client, "channels", "stats", "msgs")
+
+    # Act
+    stats_db.load_data()
+
+    # Assert
+    assert stats_db.channels == set()
+    assert stats_db.last_stats_df.empty
+    assert stats_db.msgs_df.empty
+    assert stats_db.delta == dt.timedelta(days=365)
+    for df in (stats_db.stats_df, stats_db.last_stats_df, stats_db.msgs_df):
+        assert isinstance(df["username"].dtype, pd.CategoricalDtype)
+
+
+def test_load_last_stats_dataframe_filters_on_server():
+    client = MagicMock()
+    select = client.table.return_value.select.return_value
+    created_at = "2024-01-01T10:00:00+00:00"
+    select.order.return_value.limit.return_value.execute.return_value.data = [
+        {"created_at": created_at}
+    ]
+    select.eq.return_value.execute.return_value.data = [
+        {"created_at": created_at, "username": "@a", "reach": 1, "subscribers": 2}
+    ]
+    stats_db = StatsDatabase(client, "channels", "stats", "msgs")
+
+    # Act
+    stats_db.load_last_stats_dataframe()
+
+    # Assert
+    client.table.return_value.select.assert_called_with(*STATS_DF_COLS)
+    select.eq.assert_called_once_with("created_at", created_at)
+    assert stats_db.last_stats_df.username.tolist() == ["@a"]
+    assert isinstance(stats_db.last_stats_df["username"].dtype, pd.CategoricalDtype)
+    assert stats_db.max_datetime == pd.Timestamp(created_at)
+
+
+def test_load_msgs_dataframe_stores_usernames_as_categories():
+    client = MagicMock()
+    select = client.table.return_value.select.return_value
+    select.order.return_value.execute.return_value.data = [
+        {col: "@a" for col in MSGS_DF_COLS} | {"datetime": "2024-01-01T10:00:00Z"}
+    ] * 3
+    stats_db = StatsDatabase(client, "channels", "stats", "msgs")
+
+    # Act
+    stats_db.load_msgs_dataframe()
+
+    # Assert
+    assert isinstance(stats_db.msgs_df["username"].dtype, pd.CategoricalDtype)
+    assert stats_db.msgs_df["username"].cat.categories.tolist() == ["@a"]
+
+
+def test_insert_in_chunks_reports_the_failed_chunk(caplog):
+    client = MagicMock()
+    client.table("msgs").insert.return_value.execute.side_effect = [
+        None,
+        ConnectionError("boom"),
+    ]
+    stats_db = StatsDatabase(client, "channels", "stats", "msgs")
+    data = [{"username": "@a"}] * (INSERT_CHUNK_SIZE + 1)
+
+    # Act & Assert
+    with pytest.raises(RuntimeError, match=f"first {INSERT_CHUNK_SIZE} rows") as e:
+        stats_db.insert_in_chunks("msgs", data)
+    assert isinstance(e.value.__cause__, ConnectionError)
+    assert f"rows {INSERT_CHUNK_SIZE}-{INSERT_CHUNK_SIZE + 1}" in caplog.text
@@ -0,0 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+
+from tg.supabasefs import SupabaseTableFileSystem
+
+
+@pytest.fixture
+def table():
+    return MagicMock()
+
+
+@pytest.fixture
+def fs(table):
+    return SupabaseTableFileSystem(MagicMock(table=MagicMock(return_value=table)), "t")
+
+
+def select_returns(table, data):
+    table.select.return_value.eq.return_value.execute.return_value.data = data
+
+
+def test_exists_then_getitem_is_one_request(fs, table):
+    select_returns(table, [{"key": "a", "value": "1"}])
+
+    # Act
+    assert fs.exists("a")
+    value = fs["a"]
+
+    # Assert
+    assert value == "1"
+    assert table.select.call_count == 1
+
+
+def test_missing_path_is_cached(fs, table):
+    select_returns(table, [])
+
+    # Act & Assert
+    assert not fs.exists("a")
+    assert "a" not in fs
+    with pytest.raises(KeyError):
+        fs["a"]
+    assert table.select.call_count == 1
+
+
+def test_writes_update_cache(fs, table):
+    # Act
+    fs["a"] = "1"
+    value = fs["a"]
+    fs.rm("a")
+
+    # Assert
+    assert value == "1"
+    assert not fs.exists("a")
+    table.select.assert_not_called()
+
+
+def test_invalidate_cache_refetches(fs, table):
+    select_returns(table, [])
+    assert not fs.exists("a")
+    select_returns(table, [{"key": "a", "value": ""}])
+
+    # Act
+    fs.invalidate_cache("a")
+
+    # Assert
+    assert fs.exists("a")
+    assert table.select.call_count == 2
+
+
+def test_cache_is_bounded(table):
+    fs = SupabaseTableFileSystem(
+        MagicMock(table=MagicMock(return_value=table)), "t", cache_size=2
+    )
+
+    # Act
+    for key in "abc":
+        fs[key] = key
+
+    # Assert
+    assert list(fs._cache) == ["b", "c"]
+
+
+def test_get_many_fills_cache(fs, table):
+    table.select.return_value.in_.return_value.execute.return_value.data = [
+        {"key": "a", "value": "1"}
+    ]
+
+    # Act
+    values = fs.get_many(["a", "b", "a"])
+
+    # Assert
+    assert values == {"a": "1"}
+    table.select.return_value.in_.assert_called_once_with("key", ["a", "b"])
+    assert fs["a"] == "1"
+    assert not fs.exists("b")
+    assert fs.contains_many(["a", "b"]) == {"a"}
+    assert table.select.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "mode, written, expected",
+    [
+        ("r+", "+new", "+new"),
+        ("a", "+new", "old+new"),
+        ("w", "new", "new"),
+        (None, "+new", "+new"),
+    ],
+    ids=["r+", "append", "write", "default"],
+)
+def test_open_writes_back(fs, table, mode, written, expected):
+    fs["a"] = "old"
+
+    # Act
+    with fs.open("a", mode) as f:
+        f.write(written)
+
+    # Assert
+    assert fs["a"] == expected
+
+
+def test_open_for_reading_does_not_write(fs, table):
+    fs["a"] = "old"
+    table.upsert.reset_mock()
+
+    # Act
+    with fs.open("a", "r") as f:
+        content = f.read()
+
+    # Assert
+    assert content == "old"
+    table.upsert.assert_not_called()
+
+
+def test_open_missing_for_reading(fs, table):
+    select_returns(table, [])
+
+    # Act & Assert
+    with pytest.raises(FileNotFoundError):
+        with fs.open("a", "r"):
+            pass
+
+
+def test_cache_is_thread_safe(table):
+    fs = SupabaseTableFileSystem(
+        MagicMock(table=MagicMock(return_value=table)), "t", cache_size=8
+    )
+    select_returns(table, [{"key": "a", "value": "1"}])
+
+    def hammer(i):
+        for j in range(300):
+            fs[f"{i}-{j % 16}"] = "x"
+            fs.exists(f"{i}-{(j + 3) % 16}")
+
+    # Act & Assert: no KeyError from concurrent eviction
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(hammer, range(8)))
+
+
+@pytest.mark.parametrize("mode", ["rb", "wb", "ab"])
+def test_open_rejects_binary_modes(fs, table, mode):
+    # Act & Assert
+    with pytest.raises(ValueError):
+        with fs.open("a", mode):
+            pass
+    table.upsert.assert_not_called()
@@ -1,6 +1,9 @@
 import asyncio
 import contextlib
 import datetime as dt
+import functools
+import hashlib
+import logging
 import os
 
 import icontract
@@ -9,6 +12,46 @@ from pyrogram.errors import AuthKeyUnregistered, UserDeactivated, SessionPasswor
 
 from ..utils import AbstractFileSystemProtocol
 
+logger = logging.getLogger(__name__)
+
+
+async def _fs_call(fn, *args, **kwargs):
+    """Runs a blocking file system call in a worker thread."""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def _limited(semaphore: asyncio.Semaphore, aw):
+    async with semaphore:
+        return await aw
+
+
+def _read_text(fs: AbstractFileSystemProtocol, path: str) -> str:
+    # fsspec file systems fetch small files in a single request with cat_file
+    if hasattr(fs, "cat_file"):
+        raw = fs.cat_file(path)
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    with fs.open(path, "r") as f:
+        return f.read()
+
+
+def _write_text(fs: AbstractFileSystemProtocol, path: str, text: str) -> None:
+    if hasattr(fs, "pipe_file"):
+        fs.pipe_file(path, text.encode())
+        return
+
+    with fs.open(path, "w") as f:
+        f.write(text)
+
+
+@functools.cache
+def _api_credentials() -> tuple[int, str]:
+    return int(os.environ["API_ID"]), os.environ["API_HASH"]
+
+
+def _session_digest(session_str: str) -> bytes:
+    return hashlib.blake2b(session_str.encode(), digest_size=16).digest()
+
 
 class AccountStartFailed(Exception):
     """
@@ -39,6 +82,8 @@ class Account:
         started (bool): Indicates if the account has been started.
         flood_wait_timeout (int): Timeout for flood wait.
         flood_wait_from (datetime.datetime): Start time of flood wait.
+        flood_wait_until (float): Event loop time when the flood wait ends.
+        last_used (float): time.monotonic() of the last time the account was used.
 
     Methods:
         __init__: Initialize the Account object.
@@ -53,24 +98,32 @@ class Account:
     app: pyrogram.Client
     fs: AbstractFileSystemProtocol
     phone: str
-    filename: str
 
     started: bool
     flood_wait_timeout: int
     flood_wait_from: dt.datetime
+    flood_wait_until: float
+    last_used: float
 
     def __init__(self, /, fs: AbstractFileSystemProtocol, phone=None, filename=None):
-        self.filename = filename or f"{phone}.session"
+        self._filename = filename
         self.fs = fs
         self.phone = phone
         self.started = False
         self.flood_wait_timeout = 0
         self.flood_wait_from = None
+        self.flood_wait_until = None
+        self.last_used = 0.0
         self.app = None
+        self._last_session_digest = None
 
     def __repr__(self) -> str:
         return f"<Account {self.phone}>"
 
+    @functools.cached_property
+    def filename(self) -> str:
+        return self._filename or f"{self.phone}.session"
+
     @contextlib.asynccontextmanager
     async def session(self, revalidate):
         try:
@@ -103,9 +156,9 @@ class Account:
         Examples:
             >>> await account.start(revalidate=True)
         """
-        if self.fs.exists(self.filename):
-            with self.fs.open(self.filename, "r") as f:
-                session_str = f.read()
+        if await _fs_call(self.fs.exists, self.filename):
+            session_str = await _fs_call(_read_text, self.fs, self.filename)
+            self._last_session_digest = _session_digest(session_str)
 
             self.app = pyrogram.Client(
                 self.phone, session_string=session_str, in_memory=True, no_updates=True
@@ -130,6 +183,7 @@ class Account:
         self.started = True
         self.flood_wait_timeout = 0
         self.flood_wait_from = None
+        self.flood_wait_until = None
 
     async def setup_new_session(self, code_retrieval_func, password_retrieval_func):
         """
@@ -145,8 +199,7 @@ class Account:
         print(self.phone)
         self.app = pyrogram.Client(
             self.phone,
-            os.environ["API_ID"],
-            os.environ["API_HASH"],
+            *_api_credentials(),
             in_memory=True,
             no_updates=True,
             phone_number=self.phone,
@@ -178,8 +231,13 @@ class Account:
     async def save_session_string(self):
         session_str = await self.app.export_session_string()
 
-        with self.fs.open(self.filename, "w") as f:
-            f.write(session_str)
+        # skip the write if the session has not changed since it was loaded or saved
+        digest = _session_digest(session_str)
+        if digest == self._last_session_digest:
+            return
+
+        await _fs_call(_write_text, self.fs, self.filename, session_str)
+        self._last_session_digest = digest
 
 
 class AccountCollection:
@@ -194,6 +252,7 @@ class AccountCollection:
             - "ignore": Ignore any exceptions and continue.
             - "raise": Raise AccountStartFailed if an exception occurs.
             - "revalidate": Revalidate the session if an exception occurs.
+        concurrency (int): Maximum number of accounts started or stopped at once.
 
     Examples:
         >>> collection = AccountCollection(accounts, fs, invalid)
@@ -204,12 +263,18 @@ class AccountCollection:
     accounts: dict[str, Account]
 
     @icontract.require(lambda invalid: invalid in ["ignore", "raise", "revalidate"])
+    @icontract.require(lambda concurrency: concurrency > 0)
     def __init__(
-        self, accounts: dict[str, Account], fs: AbstractFileSystemProtocol, invalid: str
+        self,
+        accounts: dict[str, Account],
+        fs: AbstractFileSystemProtocol,
+        invalid: str,
+        concurrency: int = 16,
     ):
         self.accounts = accounts
         self.fs = fs
         self.invalid = invalid
+        self.concurrency = concurrency
 
     def __getitem__(self, item):
         return self.accounts[item]
@@ -226,16 +291,21 @@ class AccountCollection:
             RuntimeError: If sessions are already in use.
         """
         SESSION_LOCK = ".session_lock"
-        if self.fs.exists(SESSION_LOCK):
+
+        # the lock is shared with other processes, so a cached answer won't do
+        if hasattr(self.fs, "invalidate_cache"):
+            self.fs.invalidate_cache(SESSION_LOCK)
+
+        if await _fs_call(self.fs.exists, SESSION_LOCK):
             raise RuntimeError("Sessions are already in use")
 
         try:
             await self.start_sessions()
-            self.fs.touch(SESSION_LOCK)
+            await _fs_call(self.fs.touch, SESSION_LOCK)
             yield
 
         finally:
-            self.fs.rm(SESSION_LOCK)
+            await _fs_call(self.fs.rm, SESSION_LOCK)
             await self.close_sessions()
 
     async def start_sessions(self):
@@ -249,34 +319,56 @@ class AccountCollection:
         Examples:
             >>> await start_sessions()
         """
-        tasks = {
-            phone: asyncio.create_task(
-                acc.start(revalidate=self.invalid == "revalidate")
+        # file systems that can read many files at once get to prefetch
+        # the session files in a single request
+        if hasattr(self.fs, "get_many"):
+            await _fs_call(
+                self.fs.get_many, [acc.filename for acc in self.accounts.values()]
             )
-            for phone, acc in self.accounts.items()
-        }
 
-        return_when = (
-            asyncio.FIRST_EXCEPTION
-            if self.invalid != "ignore"
-            else asyncio.ALL_COMPLETED
-        )
+        semaphore = asyncio.Semaphore(self.concurrency)
 
-        await asyncio.wait(tasks.values(), return_when=return_when)
+        if self.invalid == "ignore":
+            results = await asyncio.gather(
+                *[
+                    _limited(semaphore, acc.start(revalidate=False))
+                    for acc in self.accounts.values()
+                ],
+                return_exceptions=True,
+            )
 
-        # Check if any exceptions occured during the above wait
-        for phone, task in tasks.items():
-            exc = None
-            with contextlib.suppress(asyncio.InvalidStateError):
-                exc = task.exception()
+            for phone, exc in zip(self.accounts, results):
+                if isinstance(exc, Exception):
+                    logger.warning("Exception for %s: %s", phone, exc)
 
-            if exc:
-                if self.invalid != "ignore":
-                    raise AccountStartFailed(phone) from exc
-                else:
-                    print(f"Exception for {phone}: {exc}")
+            return
+
+        async def start_or_fail(phone, acc: Account):
+            try:
+                async with semaphore:
+                    await acc.start(revalidate=self.invalid == "revalidate")
+            except Exception as e:
+                raise AccountStartFailed(phone) from e
+
+        # TaskGroup cancels the remaining starts as soon as one of them fails
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for phone, acc in self.accounts.items():
+                    tg.create_task(start_or_fail(phone, acc))
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0] from eg.exceptions[0].__cause__
 
     async def close_sessions(self):
-        await asyncio.gather(
-            *[acc.stop() for acc in self.accounts.values() if acc.started]
+        started = [acc for acc in self.accounts.values() if acc.started]
+        if not started:
+            return
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *[_limited(semaphore, acc.stop()) for acc in started],
+            return_exceptions=True,
         )
+
+        for acc, exc in zip(started, results):
+            if isinstance(exc, Exception):
+                logger.warning("Exception while stopping %s: %s", acc, exc)
@@ -1,16 +1,84 @@
 import asyncio
+import collections
 import contextlib
 import datetime as dt
+import heapq
+import itertools
+import logging
+import time
 from typing import AsyncIterable
 
 import pyrogram
-from icontract import ensure, require
 
 from ..chat_cache import ChatCache, ChatCacheItem
 from . import Account, AccountCollection
-from ..utils import AbstractFileSystemProtocol, TQDMProtocol
+from ..utils import AbstractFileSystemProtocol, TQDMProtocol, ensure_at_single
 
 MAX_ACC_WAITING_TIME = 1000  # max waiting time for an available account
+MAX_ATTEMPTS = 10  # max attempts per request, a new one is made after each FloodWait
+HISTORY_PAGE_SIZE = 100  # messages per GetHistory request, the maximum Telegram allows
+
+logger = logging.getLogger(__name__)
+
+
+class AvailableAccounts:
+    """Accounts ready for use: a deque plus an event that is set while it is non-empty.
+
+    Has the subset of the asyncio.Queue interface used by Scanner.
+    """
+
+    def __init__(self):
+        self._accs = collections.deque()
+        self._event = asyncio.Event()
+
+    def put_nowait(self, acc: Account):
+        self._accs.append(acc)
+        self._event.set()
+
+    async def get(self) -> Account:
+        while not self._accs:
+            self._event.clear()
+            await self._event.wait()
+
+        return self._accs.popleft()
+
+    def qsize(self) -> int:
+        return len(self._accs)
+
+    def empty(self) -> bool:
+        return not self._accs
+
+    def clear(self):
+        self._accs.clear()
+        self._event.clear()
+
+
+class AccountLease:
+    """Async context manager returned by Scanner.get_acc.
+
+    Takes an available account on enter and puts it back on exit, unless the call
+    hit a FloodWait: then the account is sent to flood wait and the error is
+    re-raised, so that the caller can retry on another account.
+    """
+
+    __slots__ = ("scanner", "acc")
+
+    def __init__(self, scanner: "Scanner"):
+        self.scanner = scanner
+        self.acc = None
+
+    async def __aenter__(self) -> Account:
+        self.acc = await self.scanner.acquire_acc()
+        return self.acc
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        if isinstance(exc, pyrogram.errors.FloodWait):
+            self.scanner.start_flood_wait(self.acc, exc.value)
+            return False
+
+        self.acc.last_used = time.monotonic()
+        self.scanner.available_accs.put_nowait(self.acc)
+        return False
 
 
 class Scanner(AccountCollection):
@@ -36,7 +104,7 @@ class Scanner(AccountCollection):
 
         """
         new_phones = phones or [
-            item.split(".session")[0] for item in fs.glob("*.session")
+            item.removesuffix(".session") for item in fs.glob("*.session")
         ]
         super().__init__(
             accounts={phone: Account(fs, phone) for phone in new_phones},
@@ -44,6 +112,15 @@ class Scanner(AccountCollection):
             invalid="ignore",
         )
         self.phones = new_phones
+        self.available_accs = AvailableAccounts()
+        self.flood_wait_tasks = set()
+        self.inflight = {}  # (method, chat) -> task, see single_flight
+        # (flood_wait_until, tie breaker, account), stale entries are dropped lazily
+        self.flood_wait_heap = []
+        self.flood_wait_counter = itertools.count()
+        self.pbar_flood_waits = {}
+        self.pbar_base_postfix = ""
+        self.pbar_rendered_postfix = None
 
         if chat_cache:
             self.chat_cache = ChatCache(fs)
@@ -52,54 +129,128 @@ class Scanner(AccountCollection):
             self.chat_cache = None
 
         self.pbar = None
+        # number of sessions entered, the accounts are closed when it drops to 0
+        self.session_depth = 0
+        self.session_lock = None  # created in the running loop, see session
+        self.session_lock_loop = None
+        self.session_stack = None
 
-    # @ensure(lambda self: all(acc.app.is_connected for acc in self.available_accs))
-    @ensure(lambda self: all(acc.app for acc in self.accounts.values()))
     async def start_sessions(self):
         await super().start_sessions()
 
-        self.available_accs = asyncio.Queue()
+        # a fresh pool per session: its event binds to the loop it is used in,
+        # and the scanner may be reused with another loop
+        self.available_accs = AvailableAccounts()
 
-        for acc in self.accounts.values():
+        # the pool is FIFO, so the least recently used accounts are handed out first
+        for acc in sorted(
+            self.accounts.values(), key=lambda acc: (acc.last_used, acc.phone)
+        ):
             if acc.started:
                 self.available_accs.put_nowait(acc)
 
     async def close_sessions(self):
         await super().close_sessions()
-        self.available_accs = asyncio.Queue()
+
+        # pending flood waits would otherwise put stopped accounts back into the pool
+        for task in self.flood_wait_tasks:
+            task.cancel()
+
+        self.available_accs = AvailableAccounts()
 
     @contextlib.asynccontextmanager
     async def session(self, pbar: TQDMProtocol = None):
+        """
+        Context manager for the account sessions, see AccountCollection.session.
+
+        Nested and overlapping sessions share the connections: the accounts
+        are started when the first session is entered and closed when the
+        last one is exited. The first progress bar passed in is used
+        until then.
+        """
+        # the lock binds to the loop it is used in, and the scanner
+        # may be reused with another loop
+        loop = asyncio.get_running_loop()
+        if self.session_lock_loop is not loop:
+            self.session_lock = asyncio.Lock()
+            self.session_lock_loop = loop
+
+        # later entrants wait here until the accounts have started
+        async with self.session_lock:
+            if not self.session_depth:
+                stack = contextlib.AsyncExitStack()
+                await stack.enter_async_context(super().session())
+                self.session_stack = stack
+
+            self.session_depth += 1
+            if pbar and not self.pbar:
+                self.pbar = pbar
+
         try:
-            self.pbar = pbar
-            async with super().session():
-                yield
+            yield
         finally:
-            if self.chat_cache:
-                self.chat_cache.save()
-            self.pbar = None
+            async with self.session_lock:
+                self.session_depth -= 1
+                if not self.session_depth:
+                    stack, self.session_stack = self.session_stack, None
+                    try:
+                        await stack.aclose()
+                    finally:
+                        if self.chat_cache:
+                            self.chat_cache.save()
+                        self.pbar = None
+                        self.pbar_base_postfix = ""
+                        self.pbar_rendered_postfix = None
 
     async def get_chat(self, chat_id) -> pyrogram.types.Chat:
         if not self.chat_cache:
-            return await self.process_command("get_chat", chat_id)
+            return await self.single_flight("get_chat", chat_id)
 
-        if chat_id not in self.chat_cache:
-            chat = await self.process_command("get_chat", chat_id)
-            self.chat_cache[chat_id] = ChatCacheItem(chat)
-
-        return self.chat_cache[chat_id].chat
+        return (await self.get_chat_cache_item(chat_id)).chat
 
     async def get_chat_members_count(self, chat_id) -> int:
         if not self.chat_cache:
-            return await self.process_command("get_chat_members_count", chat_id)
+            return await self.single_flight("get_chat_members_count", chat_id)
+
+        chat_cache_item = self.chat_cache.get(chat_id)
+        if chat_cache_item and chat_cache_item.members_count:
+            return chat_cache_item.members_count
 
-        chat_cache_item = self.chat_cache[chat_id]
+        # the cached chat usually already carries the members count
+        chat_cache_item = chat_cache_item or await self.get_chat_cache_item(chat_id)
         if not chat_cache_item.members_count:
-            chat_cache_item.members_count = await self.process_command(
-                "get_chat_members_count", chat_id
+            chat_cache_item.members_count = (
+                chat_cache_item.chat.members_count
+                or await self.single_flight("get_chat_members_count", chat_id)
             )
+            self.chat_cache[chat_id] = chat_cache_item  # mark as changed
         return chat_cache_item.members_count
 
+    async def get_chat_cache_item(self, chat_id) -> ChatCacheItem:
+        chat_cache_item = self.chat_cache.get(chat_id)
+        if chat_cache_item is None:
+            chat = await self.single_flight("get_chat", chat_id)
+            chat_cache_item = self.chat_cache.get(chat_id)
+            if chat_cache_item is None:
+                chat_cache_item = self.chat_cache[chat_id] = ChatCacheItem(chat)
+
+        return chat_cache_item
+
+    async def single_flight(self, method: str, chat_id):
+        """Runs process_command(method, chat_id) once for all the concurrent
+        callers that ask for the same chat."""
+        key = (method, ensure_at_single(chat_id))
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.create_task(
+                self.process_command(method, chat_id)
+            )
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+
+        # a cancelled caller must not cancel the request for the others
+        return await asyncio.shield(task)
+
     async def get_discussion_replies_count(self, chat_id, msg_id) -> int:
         try:
             return await self.process_command(
@@ -108,17 +259,46 @@ class Scanner(AccountCollection):
         except pyrogram.errors.MsgIdInvalid:
             return 0
 
-    @require(lambda min_date: isinstance(min_date, dt.datetime) or min_date is None)
     async def get_chat_history(
         self, chat_id, limit=None, min_date=None
     ) -> AsyncIterable[pyrogram.types.Message]:
-        async for msg in self.process_iterator(
-            "get_chat_history",
-            chat_id,
-            limit,
-            breaking_trigger=lambda msg: msg.date < min_date if min_date else False,
-        ):
-            yield msg
+        assert min_date is None or isinstance(min_date, dt.datetime)
+
+        if min_date is None:
+            breaking_trigger = lambda msg: False
+        else:
+            # pyrogram message dates are naive local time, so normalize once here
+            # rather than per message
+            if min_date.tzinfo:
+                min_date = min_date.astimezone().replace(tzinfo=None)
+            breaking_trigger = lambda msg: msg.date < min_date
+
+        # fetch page by page, so that the account goes back to the pool
+        # while the caller processes the page
+        # like in pyrogram, a falsy limit means no limit
+        limit = limit or None
+        offset_id = 0
+        yielded = 0
+
+        while limit is None or yielded < limit:
+            page_size = HISTORY_PAGE_SIZE if limit is None else min(
+                HISTORY_PAGE_SIZE, limit - yielded
+            )
+            page = await self.process_page(
+                "get_chat_history", chat_id, limit=page_size, offset_id=offset_id
+            )
+
+            for msg in page:
+                if breaking_trigger(msg):
+                    return
+                yield msg
+
+            # a short page is the end of the history
+            if len(page) < page_size:
+                return
+
+            yielded += len(page)
+            offset_id = page[-1].id
 
     async def get_discussion_replies(
         self, chat_id, msg_id, limit=None
@@ -130,23 +310,57 @@ class Scanner(AccountCollection):
                 yield msg
 
     async def process_command(self, method: str, *args: list):
-        while True:
-            async with self.get_acc() as acc:
-                return await getattr(acc.app, method)(*args)
+        for _ in range(MAX_ATTEMPTS):
+            with contextlib.suppress(pyrogram.errors.FloodWait):
+                async with self.get_acc() as acc:
+                    return await getattr(acc.app, method)(*args)
+
+            # the account went to flood wait: retry on another one
+
+        raise RuntimeError(f"{method} hit FloodWait {MAX_ATTEMPTS} times in a row.")
+
+    async def process_page(self, method: str, *args: list, **kwargs) -> list:
+        """Collects the results of an iterator method, holding the account
+        only until they are all received."""
+        for _ in range(MAX_ATTEMPTS):
+            with contextlib.suppress(pyrogram.errors.FloodWait):
+                async with self.get_acc() as acc:
+                    return [
+                        result
+                        async for result in getattr(acc.app, method)(*args, **kwargs)
+                    ]
+
+        raise RuntimeError(f"{method} hit FloodWait {MAX_ATTEMPTS} times in a row.")
 
     async def process_iterator(
         self, method: str, *args: list, breaking_trigger=lambda x: False
     ):
-        while True:
-            async with self.get_acc() as acc:
-                async for result in getattr(acc.app, method)(*args):
-                    if breaking_trigger(result):
-                        break
-                    yield result
-                break
+        yielded = 0
 
-    @contextlib.asynccontextmanager
-    async def get_acc(self):  # sourcery skip: raise-from-previous-error
+        for _ in range(MAX_ATTEMPTS):
+            with contextlib.suppress(pyrogram.errors.FloodWait):
+                async with self.get_acc() as acc:
+                    # after a FloodWait the iteration starts over on another account,
+                    # so skip the results that were already yielded
+                    to_skip = yielded
+
+                    async for result in getattr(acc.app, method)(*args):
+                        if to_skip:
+                            to_skip -= 1
+                            continue
+                        if breaking_trigger(result):
+                            return
+                        yield result
+                        yielded += 1
+
+                    return
+
+        raise RuntimeError(f"{method} hit FloodWait {MAX_ATTEMPTS} times in a row.")
+
+    def get_acc(self) -> "AccountLease":
+        return AccountLease(self)
+
+    async def acquire_acc(self) -> Account:  # sourcery skip: raise-from-previous-error
         min_wait = self.min_wait()
         if min_wait and min_wait > MAX_ACC_WAITING_TIME:
             available_at = dt.datetime.now() + dt.timedelta(seconds=min_wait)
@@ -155,55 +369,80 @@ class Scanner(AccountCollection):
             )
 
         try:
-            acc: Account = await asyncio.wait_for(
-                self.available_accs.get(), timeout=MAX_ACC_WAITING_TIME
-            )
-        except asyncio.TimeoutError:
+            async with asyncio.timeout(MAX_ACC_WAITING_TIME):
+                return await self.available_accs.get()
+        except TimeoutError:
             raise RuntimeError(
                 "All accounts unavailable. "
                 f"Max waiting time of {MAX_ACC_WAITING_TIME} secs exceeded."
             )
 
-        try:
-            yield acc
-            self.available_accs.put_nowait(acc)
-
-        except pyrogram.errors.FloodWait as e:
-            asyncio.create_task(self.flood_wait(acc, e.value))
-
-        except Exception as e:
-            self.available_accs.put_nowait(acc)
-            raise
-
     def min_wait(self):
-        return min(
-            (
-                acc.flood_wait_timeout
-                - (dt.datetime.now() - acc.flood_wait_from).seconds
-                for acc in self.accounts.values()
-                if acc.flood_wait_from
-            ),
-            default=None,
+        # drop the entries of accounts whose flood wait has already ended
+        while (
+            self.flood_wait_heap
+            and self.flood_wait_heap[0][2].flood_wait_until
+            != self.flood_wait_heap[0][0]
+        ):
+            heapq.heappop(self.flood_wait_heap)
+
+        if not self.flood_wait_heap:
+            return None
+
+        return self.flood_wait_heap[0][0] - asyncio.get_running_loop().time()
+
+    def start_flood_wait(self, acc: Account, timeout: int):
+        # an account is leased to one request at a time, so it can only get here
+        # once per flood wait; the reference keeps the task from being garbage
+        # collected while it sleeps
+        task = asyncio.create_task(self.flood_wait(acc, timeout))
+        self.flood_wait_tasks.add(task)
+        task.add_done_callback(self.flood_wait_tasks.discard)
+
+    def render_flood_waits(self):
+        # concurrent flood waits share one postfix instead of each one
+        # saving and restoring its own copy of it; whatever else the postfix
+        # shows (e.g. the channel being scanned) is kept in front of them,
+        # and if it was changed since the last render, it is the new base
+        postfix = self.pbar.postfix or ""
+        if postfix != self.pbar_rendered_postfix:
+            self.pbar_base_postfix = postfix
+
+        rendered = ", ".join(
+            [
+                *filter(None, [self.pbar_base_postfix]),
+                *(
+                    f"{acc}: flood_wait {timeout} secs"
+                    for acc, timeout in self.pbar_flood_waits.items()
+                ),
+            ]
         )
+        self.pbar.set_postfix_str(rendered)
+        self.pbar_rendered_postfix = rendered
 
     async def flood_wait(self, acc: Account, timeout: int):
         acc.flood_wait_from = dt.datetime.now()
         acc.flood_wait_timeout = timeout
+        acc.flood_wait_until = asyncio.get_running_loop().time() + timeout
+        heapq.heappush(
+            self.flood_wait_heap,
+            (acc.flood_wait_until, next(self.flood_wait_counter), acc),
+        )
 
         if self.pbar:
-            old_postfix = self.pbar.postfix or ""
-            self.pbar.set_postfix_str(
-                ", ".join([old_postfix, f"flood_wait {timeout} secs"])
-            )
+            self.pbar_flood_waits[acc] = timeout
+            self.render_flood_waits()
         else:
-            print(f"{acc}: flood_wait {timeout} secs")
+            logger.warning("%s: flood_wait %s secs", acc, timeout)
 
-        await asyncio.sleep(timeout)
+        try:
+            await asyncio.sleep(timeout)
+        finally:
+            acc.flood_wait_from = None
+            acc.flood_wait_timeout = 0
+            acc.flood_wait_until = None
 
-        if self.pbar:
-            self.pbar.set_postfix_str(old_postfix)
+            if self.pbar_flood_waits.pop(acc, None) is not None and self.pbar:
+                self.render_flood_waits()
 
         self.available_accs.put_nowait(acc)
-
-        acc.flood_wait_from = None
-        acc.flood_wait_timeout = 0
@@ -1,8 +1,12 @@
-import cloudpickle
+import pickle
+
 import pyrogram
 
 from ..utils import ensure_at_single
 
+CACHE_FILE = ".chat_cache"
+LOG_FILE = ".chat_cache.log"  # items changed since CACHE_FILE was last written
+
 
 class ChatCacheItem:
     """ "Элемент кэша чатов."""
@@ -16,29 +20,91 @@ class ChatCacheItem:
 
 
 class ChatCache:
+    """
+    Cache of chats, persisted to the file system.
+
+    `save` appends only the items changed since the last save to a log file,
+    and rewrites the full cache once the log grows to a quarter of the cache.
+    Items changed in place must be stored again with `cache[key] = item`
+    to be saved.
+    """
+
     cache: dict[str, ChatCacheItem]
+    dirty: set[str]
 
     def __init__(self, fs):
         self.cache = {}
         self.fs = fs
+        self.dirty = set()
+        self.log_length = 0
 
     def __getitem__(self, key):
         return self.cache[ensure_at_single(key)]
 
     def __setitem__(self, key, value):
-        self.cache[ensure_at_single(key)] = value
+        key = ensure_at_single(key)
+        self.cache[key] = value
+        self.dirty.add(key)
 
     def __contains__(self, key):
         return ensure_at_single(key) in self.cache
 
+    def get(self, key, default=None):
+        return self.cache.get(ensure_at_single(key), default)
+
     def load(self):
-        if self.fs.exists(".chat_cache"):
-            with self.fs.open(".chat_cache", "rb") as f:
-                self.chat_cache = cloudpickle.load(f)
+        if self.fs.exists(CACHE_FILE):
+            with self.fs.open(CACHE_FILE, "rb") as f:
+                self.cache = pickle.load(f)
+
+        self.log_length = 0
+        if self.fs.exists(LOG_FILE):
+            with self.fs.open(LOG_FILE, "rb") as f:
+                while True:
+                    try:
+                        key, value = pickle.load(f)
+                    except EOFError:
+                        break
+                    self.cache[key] = value
+                    self.log_length += 1
 
         # нормализуем все названия чатов при загрузке
         self.cache = {ensure_at_single(key): value for key, value in self.cache.items()}
+        self.dirty = set()
 
     def save(self):
-        with self.fs.open(".chat_cache", "wb") as f:
-            cloudpickle.dump(self.chat_cache, f)
+        if not self.dirty:
+            return
+
+        if (
+            self.fs.exists(CACHE_FILE)
+            and self.log_length + len(self.dirty) < len(self.cache) // 4
+        ):
+            self.append_to_log()
+        else:
+            self.compact()
+
+        self.dirty = set()
+
+    def append_to_log(self):
+        with self.fs.open(LOG_FILE, "ab") as f:
+            for key in self.dirty:
+                pickle.dump((key, self.cache[key]), f, pickle.HIGHEST_PROTOCOL)
+
+        self.log_length += len(self.dirty)
+
+    def compact(self):
+        if hasattr(self.fs, "mv"):
+            # write to a temporary file first, so that a failed write
+            # does not leave a truncated cache behind
+            with self.fs.open(f"{CACHE_FILE}.tmp", "wb") as f:
+                pickle.dump(self.cache, f, pickle.HIGHEST_PROTOCOL)
+            self.fs.mv(f"{CACHE_FILE}.tmp", CACHE_FILE)
+        else:
+            with self.fs.open(CACHE_FILE, "wb") as f:
+                pickle.dump(self.cache, f, pickle.HIGHEST_PROTOCOL)
+
+        if self.fs.exists(LOG_FILE):
+            self.fs.rm(LOG_FILE)
+
+        self.log_length = 0
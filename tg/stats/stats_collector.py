@@ -1,9 +1,9 @@
 import asyncio
 import datetime as dt
 from collections import namedtuple
-from itertools import chain
 from icontract import require
 
+import numpy as np
 import pandas as pd
 
 from ..account import Scanner
@@ -12,13 +12,29 @@ from .stats_db import StatsDatabase
 Msg = namedtuple("Message", "username link reach likes replies forwards datetime text full_text")
 Channel = namedtuple("Channel", "username subscribers")
 
+MSG_COUNT_DTYPES = dict.fromkeys(["reach", "likes", "replies", "forwards"], "int64")
+
+REPLIES_BATCH_SIZE = 64  # reply counts requested at once per channel
+# Reply counts of messages older than this are taken from the previous scan
+# instead of being requested again. This trades tracking of late replies to
+# old posts for fewer requests: younger messages, whose counts still change,
+# are always requested anew.
+REPLIES_CACHE_MIN_AGE = dt.timedelta(days=7)
+
 
 class StatsCollector:
     scanner: Scanner
 
     @require(lambda min_date: isinstance(min_date, dt.datetime) or min_date is None)
-    def __init__(self, scanner, /, min_date=None, depth=None):
+    def __init__(self, scanner, /, min_date=None, depth=None, concurrency=None):
         self.scanner = scanner
+        # keep a few requests per account in flight instead of queueing
+        # every channel and every message on the account pool at once
+        self.concurrency = concurrency or max(4, len(scanner.accounts) * 4)
+        self._semaphores = None
+        self._semaphores_loop = None
+        # channel -> message id -> replies, as of the last scan of the channel
+        self.replies_cache: dict[str, dict[int, int]] = {}
         self.min_date = min_date
         if depth and min_date:
             raise ValueError("Can't set both depth and min_date")
@@ -27,6 +43,26 @@ class StatsCollector:
                 dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=depth)
             ).replace(tzinfo=None)
 
+    def semaphores(self) -> tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        # semaphores bind to the loop they are used in, and the collector
+        # may be reused with another loop
+        loop = asyncio.get_running_loop()
+        if self._semaphores_loop is not loop:
+            self._semaphores = (
+                asyncio.Semaphore(self.concurrency),
+                asyncio.Semaphore(self.concurrency),
+            )
+            self._semaphores_loop = loop
+        return self._semaphores
+
+    @property
+    def channels_semaphore(self) -> asyncio.Semaphore:
+        return self.semaphores()[0]
+
+    @property
+    def replies_semaphore(self) -> asyncio.Semaphore:
+        return self.semaphores()[1]
+
     async def collect_all_stats(self, channels, pbar=None):
         async with self.scanner.session(pbar):
             if pbar:
@@ -35,8 +71,12 @@ class StatsCollector:
             else:
                 msg_stats, channel_stats = await self.parallel_scan(channels)
 
-        self.msgs_df = pd.DataFrame(msg_stats)
-        self.channels_df = pd.DataFrame(channel_stats)
+        # counts are always ints: fix their dtype, so that it is not
+        # inferred as object when no messages were collected
+        self.msgs_df = pd.DataFrame(to_columns(msg_stats, Msg._fields)).astype(
+            MSG_COUNT_DTYPES
+        )
+        self.channels_df = pd.DataFrame(to_columns(channel_stats, Channel._fields))
 
         self.calc_msg_popularity()
         self.collect_stats_to_single_df()
@@ -56,14 +96,28 @@ class StatsCollector:
         return msg_stats, channel_stats
 
     async def parallel_scan(self, channels):
-        msg_stats = chain.from_iterable(
-            await asyncio.gather(*[self.collect_msg_stats(c) for c in channels])
-        )
-        channel_stats = await asyncio.gather(
-            *[self.collect_channel_stats(c) for c in channels]
+        async def collect_msgs():
+            # collect messages as channels complete, so that each channel's
+            # list can be freed as soon as it has been copied over
+            msg_stats = []
+            for channel_msgs in asyncio.as_completed(
+                [self.limited(self.collect_msg_stats(c)) for c in channels]
+            ):
+                msg_stats.extend(await channel_msgs)
+
+            return msg_stats
+
+        # channel stats are collected alongside the messages, not after them
+        return await asyncio.gather(
+            collect_msgs(),
+            asyncio.gather(
+                *[self.limited(self.collect_channel_stats(c)) for c in channels]
+            ),
         )
 
-        return msg_stats, channel_stats
+    async def limited(self, aw):
+        async with self.channels_semaphore:
+            return await aw
 
     async def collect_msg_stats(self, channel) -> list[Msg]:
         msgs_dict = {}
@@ -89,13 +143,40 @@ class StatsCollector:
                 full_text=full_text,
             )
 
+        cached_before = dt.datetime.now() - REPLIES_CACHE_MIN_AGE
+        cached_replies = self.replies_cache.get(channel, {})
+
         async def add_replies(msg_id, msg: Msg) -> Msg:
-            replies = await self.scanner.get_discussion_replies_count(channel, msg_id)
+            if msg.datetime < cached_before and msg_id in cached_replies:
+                return msg._replace(replies=cached_replies[msg_id])
+
+            async with self.replies_semaphore:
+                replies = await self.scanner.get_discussion_replies_count(
+                    channel, msg_id
+                )
             return msg._replace(replies=replies)
 
-        return await asyncio.gather(
-            *[add_replies(msg_id, msg) for msg_id, msg in msgs_dict.items()]
-        )
+        # gather in batches, so that a long history does not spawn
+        # a task for every message at once
+        items = list(msgs_dict.items())
+        msgs = []
+        for start in range(0, len(items), REPLIES_BATCH_SIZE):
+            msgs.extend(
+                await asyncio.gather(
+                    *[
+                        add_replies(msg_id, msg)
+                        for msg_id, msg in items[start : start + REPLIES_BATCH_SIZE]
+                    ]
+                )
+            )
+
+        # only the messages of this scan are kept, so that messages which
+        # have left the min_date window do not pile up in the cache
+        self.replies_cache[channel] = {
+            msg_id: msg.replies for msg_id, msg in zip(msgs_dict, msgs)
+        }
+
+        return msgs
 
     async def collect_channel_stats(self, channel) -> Channel:
         chat = await self.scanner.get_chat(channel)
@@ -103,12 +184,31 @@ class StatsCollector:
         return Channel(username=channel, subscribers=chat.members_count)
 
     def calc_msg_popularity(self):
-        self.msgs_df["popularity"] = (
-            self.msgs_df.likes + self.msgs_df.replies + self.msgs_df.forwards
-        ) / self.msgs_df.reach
+        reach = self.msgs_df.reach.to_numpy()
+        reactions = (
+            self.msgs_df.likes.to_numpy()
+            + self.msgs_df.replies.to_numpy()
+            + self.msgs_df.forwards.to_numpy()
+        )
+
+        # messages without views have no popularity rather than an infinite one,
+        # so the division is skipped for them instead of being masked afterwards
+        popularity = np.full(len(reach), np.nan)
+        np.divide(reactions, reach, out=popularity, where=reach > 0)
+        self.msgs_df["popularity"] = popularity
 
     def collect_stats_to_single_df(self):
-        self.stats = self.msgs_df.groupby("username").agg({"reach": "mean"}).astype(int)
+        # mean reach per channel: factorize the usernames once and sum with bincount
+        usernames, codes = np.unique(
+            self.msgs_df.username.to_numpy(), return_inverse=True
+        )
+        reach_sums = np.bincount(codes, weights=self.msgs_df.reach.to_numpy())
+        reach = reach_sums / np.bincount(codes)
+
+        self.stats = pd.DataFrame(
+            {"reach": reach.round().astype(int)},
+            index=pd.Index(usernames, name="username"),
+        )
         self.stats["subscribers"] = self.channels_df.set_index("username")[
             "subscribers"
         ]
@@ -120,9 +220,16 @@ class StatsCollector:
         stats_db.save_msgs(self.msgs_df)
 
 
+def to_columns(rows, fields) -> dict[str, tuple]:
+    """Transposes rows of namedtuples into columns, so that pandas
+    does not have to inspect every row when building a DataFrame."""
+    columns = list(zip(*rows)) or [()] * len(fields)
+    return dict(zip(fields, columns))
+
+
 def shorten(text: str, max_length=200):
     return (
-        text.encode("utf-8").decode("utf-8")[:max_length] + "..."
+        text[:max_length] + "..."
         if isinstance(text, str) and len(text) > max_length
         else text
     )
@@ -1,4 +1,6 @@
 import datetime as dt
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import supabase
@@ -13,11 +15,17 @@ MSGS_DF_COLS = [
     "datetime",
     "text",
 ]
+STATS_DF_COLS = ["created_at", "username", "reach", "subscribers"]
+
+INSERT_CHUNK_SIZE = 500  # rows per insert request, keeps the request bodies small
+
+logger = logging.getLogger(__name__)
 
 
 class StatsDatabase:
-    """Loads the channel list and the full statistics dataframe from the Supabase database.
-    Calculates the last statictics dataframe and timedelta since the last statictics update.
+    """Loads the channel list and the last statistics dataframe from the Supabase database.
+    Calculates the timedelta since the last statictics update.
+    The full statistics dataframe is loaded on first access to stats_df.
     Saves new statictics to the database."""
 
     def __init__(
@@ -27,13 +35,34 @@ class StatsDatabase:
         self.channels_table = channels_table
         self.stats_table = stats_table
         self.msgs_table = msgs_table
+        self._stats_df = None
+
+    @property
+    def stats_df(self) -> pd.DataFrame:
+        """The full statistics dataframe, loaded on first access."""
+        if self._stats_df is None:
+            self.load_stats_dataframe()
+        return self._stats_df
+
+    @stats_df.setter
+    def stats_df(self, value: pd.DataFrame):
+        self._stats_df = value
 
     def load_data(self) -> None:
-        """Loads the channel list and the full statistics dataframe from the Supabase database."""
-        self.load_channel_list()
-        self.load_stats_dataframe()
-        self.load_msgs_dataframe()
-        self.calc_last_stats_dataframe()
+        """Loads the channel list and the last statistics dataframe from the Supabase database."""
+        # the tables are independent, so they are fetched in parallel
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(load)
+                for load in (
+                    self.load_channel_list,
+                    self.load_last_stats_dataframe,
+                    self.load_msgs_dataframe,
+                )
+            ]
+        for future in futures:
+            future.result()
+
         self.calc_timedelta_since_last_stats_update()
 
     def load_channel_list(self):
@@ -47,30 +76,66 @@ class StatsDatabase:
         """Returns the full statistics dataframe from the database."""
         self.stats_df = pd.DataFrame(
             self.client.table(self.stats_table)
-            .select("*")
+            .select(*STATS_DF_COLS)
             .order("created_at", desc=True)
             .execute()
             .data
         )
         if self.stats_df.empty:
-            self.stats_df = pd.DataFrame(
-                columns=["created_at", "username", "reach", "subscribers"]
+            self.stats_df = pd.DataFrame(columns=STATS_DF_COLS).astype(
+                {"username": "category"}
             )
             return
         self.stats_df["created_at"] = to_msk(self.stats_df["created_at"])
+        # every snapshot repeats all the usernames
+        self.stats_df["username"] = self.stats_df["username"].astype("category")
+
+    def load_last_stats_dataframe(self):
+        """Loads only the last statistics snapshot, filtering on the server side."""
+        last = (
+            self.client.table(self.stats_table)
+            .select("created_at")
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+            .data
+        )
+        if not last:
+            self.max_datetime = dt.datetime(1980, 1, 1)
+            self.last_stats_df = pd.DataFrame(columns=STATS_DF_COLS).astype(
+                {"username": "category"}
+            )
+            return
+
+        self.last_stats_df = pd.DataFrame(
+            self.client.table(self.stats_table)
+            .select(*STATS_DF_COLS)
+            .eq("created_at", last[0]["created_at"])
+            .execute()
+            .data
+        )
+        self.last_stats_df["created_at"] = to_msk(self.last_stats_df["created_at"])
+        # same dtype as when it is taken from stats_df in calc_last_stats_dataframe
+        self.last_stats_df["username"] = self.last_stats_df["username"].astype(
+            "category"
+        )
+        self.max_datetime = self.last_stats_df.created_at.max()
 
     def load_msgs_dataframe(self):
         self.msgs_df = pd.DataFrame(
             self.client.table(self.msgs_table)
-            .select("*")
+            .select(*MSGS_DF_COLS)
             .order("datetime", desc=True)
             .execute()
             .data
         )
         if self.msgs_df.empty:
-            self.msgs_df = pd.DataFrame(columns=MSGS_DF_COLS)
+            self.msgs_df = pd.DataFrame(columns=MSGS_DF_COLS).astype(
+                {"username": "category"}
+            )
             return
         self.msgs_df["datetime"] = to_msk(self.msgs_df["datetime"])
+        self.msgs_df["username"] = self.msgs_df["username"].astype("category")
 
     def calc_last_stats_dataframe(self):
         """Calculates the last statictics dataframe from the database."""
@@ -85,7 +150,7 @@ class StatsDatabase:
 
     def calc_timedelta_since_last_stats_update(self):
         """Calculates the timedelta since the last statictics update."""
-        if self.stats_df.empty:
+        if self.last_stats_df.empty:
             self.delta = dt.timedelta(days=365)
         else:
             self.delta = dt.datetime.now(dt.timezone.utc) - self.max_datetime
@@ -93,23 +158,54 @@ class StatsDatabase:
     def save_new_stats_to_db(self, stats_df: pd.DataFrame):
         """Saves the new statictics dataframe to the database."""
         data = stats_df[["username", "reach", "subscribers"]].to_dict("records")
-        self.client.table(self.stats_table).insert(data).execute()
+        self.insert_in_chunks(self.stats_table, data)
 
     def save_msgs(self, msgs_df: pd.DataFrame):
         """Updates recent messages and their stats in the messages table."""
 
-        # convert datetime to str so it can be saved to postgres
-        datetime_old = msgs_df["datetime"]
-        msgs_df["datetime"] = msgs_df["datetime"].astype("str")
-
-        data = msgs_df[MSGS_DF_COLS].to_dict("records")
+        # convert datetime to str so it can be saved to postgres,
+        # leaving the caller's dataframe untouched
+        data = (
+            msgs_df[MSGS_DF_COLS]
+            .assign(datetime=msgs_df["datetime"].astype("str"))
+            .to_dict("records")
+        )
 
         table = self.client.table(self.msgs_table)
         table.delete().neq("username", "anyone").execute()  # deletes all rows
-        table.insert(data).execute()
-
-        msgs_df["datetime"] = datetime_old
+        self.insert_in_chunks(self.msgs_table, data)
+
+    def insert_in_chunks(self, table_name: str, data: list[dict]):
+        """Inserts the rows INSERT_CHUNK_SIZE at a time.
+
+        Raises:
+            RuntimeError: If a chunk fails. The chunks before it stay inserted,
+            so the table holds only part of the data.
+        """
+        table = self.client.table(table_name)
+        for start in range(0, len(data), INSERT_CHUNK_SIZE):
+            end = min(start + INSERT_CHUNK_SIZE, len(data))
+            try:
+                table.insert(data[start:end]).execute()
+            except Exception as e:
+                logger.error(
+                    "Inserting rows %s-%s of %s into %s failed, "
+                    "only the first %s rows were saved: %s",
+                    start,
+                    end,
+                    len(data),
+                    table_name,
+                    start,
+                    e,
+                )
+                raise RuntimeError(
+                    f"Inserting rows {start}-{end} of {len(data)} into {table_name} "
+                    f"failed, the table holds only the first {start} rows"
+                ) from e
 
 
 def to_msk(col):
-    return pd.to_datetime(col, utc=True).dt.tz_convert("Europe/Moscow")
+    # postgres returns ISO 8601 timestamps: skip the per-element format inference
+    return pd.to_datetime(col, utc=True, format="ISO8601").dt.tz_convert(
+        "Europe/Moscow"
+    )
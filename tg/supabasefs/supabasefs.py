@@ -1,22 +1,108 @@
+import collections
 import contextlib
-import os
-import tempfile
+import io
+import threading
 
 import supabase
 
+GET_MANY_CHUNK_SIZE = 200  # keys per request, keeps the query string short
+
 
 class SupabaseTableFileSystem:
-    def __init__(self, supabase: supabase.Client, table_name):
+    """File system stored in a Supabase table with `key` and `value` columns.
+
+    Rows read or written through an instance are kept in a small LRU cache,
+    so that `exists(path)` followed by `fs[path]` costs a single request.
+    Changes made by other processes are not seen until `invalidate_cache`
+    is called for the path."""
+
+    def __init__(self, supabase: supabase.Client, table_name, cache_size=512):
         self.table = supabase.table(table_name)
+        self.cache_size = cache_size
+        self._cache: collections.OrderedDict[str, dict | None] = (
+            collections.OrderedDict()
+        )
+        # the file system is called from worker threads, see _fs_call
+        self._cache_lock = threading.Lock()
+
+    def _get_row(self, path) -> dict | None:
+        """Returns the row for the path or None if there is none."""
+        with self._cache_lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                return self._cache[path]
+
+        data = self.table.select("key", "value").eq("key", path).execute().data
+        row = data[0] if data else None
+        self._cache_row(path, row)
+        return row
+
+    def _cache_row(self, path, row: dict | None):
+        if not self.cache_size:
+            return
+
+        with self._cache_lock:
+            self._cache[path] = row
+            self._cache.move_to_end(path)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get_many(self, paths) -> dict[str, str]:
+        """Returns the values of the existing paths, fetched in as few requests as possible."""
+        paths = list(dict.fromkeys(paths))
+        values = {}
+
+        missing = []
+        with self._cache_lock:
+            for path in paths:
+                if path not in self._cache:
+                    missing.append(path)
+                elif self._cache[path] is not None:
+                    values[path] = self._cache[path]["value"]
+
+        for start in range(0, len(missing), GET_MANY_CHUNK_SIZE):
+            chunk = missing[start : start + GET_MANY_CHUNK_SIZE]
+            rows = {
+                row["key"]: row
+                for row in self.table.select("key", "value")
+                .in_("key", chunk)
+                .execute()
+                .data
+            }
+            for path in chunk:
+                row = rows.get(path)
+                self._cache_row(path, row)
+                if row is not None:
+                    values[path] = row["value"]
+
+        return values
+
+    def contains_many(self, paths) -> set[str]:
+        """Returns the subset of the paths that exist."""
+        return set(self.get_many(paths))
+
+    def invalidate_cache(self, path=None):
+        """Drops the cached row for the path, or all cached rows if no path is given."""
+        with self._cache_lock:
+            if path is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(path, None)
 
     def __getitem__(self, path):
-        return self.table.select("value").eq("key", path).execute().data[0]["value"]
+        row = self._get_row(path)
+        if row is None:
+            raise KeyError(path)
+        return row["value"]
 
     def __setitem__(self, path, value):
-        self.table.upsert({"key": path, "value": value}).execute()
+        row = {"key": path, "value": value}
+        self.table.upsert(row).execute()
+        self._cache_row(path, row)
 
     def __delitem__(self, path):
         self.table.delete().eq("key", path).execute()
+        self._cache_row(path, None)
 
     def keys(self):
         return [
@@ -25,7 +111,7 @@ class SupabaseTableFileSystem:
         ]
 
     def __contains__(self, path):
-        return path in self.keys()
+        return self._get_row(path) is not None
 
     def ls(self, *args):
         return self.keys()
@@ -50,13 +136,30 @@ class SupabaseTableFileSystem:
 
     @contextlib.contextmanager
     def open(self, path, mode=None):
-        with tempfile.TemporaryDirectory() as td:
-            with open(os.path.join(td, path), "x+") as f:
-                if self.exists(path):
-                    f.write(self[path])
-                    f.seek(0)
-
-                yield f
-
-            with open(os.path.join(td, path), "r") as f:
-                self[path] = f.read()
+        """Opens the value as an in-memory text file.
+        Writes it back on exit unless opened with mode "r".
+
+        Raises:
+            ValueError: For binary modes, since the values are stored as text.
+        """
+        mode = (mode or "r+").replace("t", "")
+        if "b" in mode:
+            raise ValueError(f"Binary mode {mode!r} is not supported")
+
+        if "w" in mode:
+            initial = ""
+        elif self.exists(path):
+            initial = self[path]
+        elif mode == "r":
+            raise FileNotFoundError(path)
+        else:
+            initial = ""
+
+        f = io.StringIO(initial)
+        if "a" in mode:
+            f.seek(0, io.SEEK_END)
+
+        yield f
+
+        if mode != "r":
+            self[path] = f.getvalue()
@@ -1,6 +1,9 @@
-import re
+import asyncio
+import functools
 import io
-from typing import Protocol
+import re
+import sys
+from typing import Callable, Protocol
 
 
 def ensure_ats(strs: set[str]) -> set[str]:
@@ -8,52 +11,76 @@ def ensure_ats(strs: set[str]) -> set[str]:
 
 
 def ensure_at_single(s: str) -> str:
-    return (
-        s
-        if not isinstance(s, str)
-        else (s.lower() if s.startswith("@") else f"@{s.lower()}")
-    )
+    return _ensure_at_str(s) if isinstance(s, str) else s
+
+
+# the same few usernames are normalized over and over during scans
+@functools.lru_cache(maxsize=4096)
+def _ensure_at_str(s: str) -> str:
+    return s.lower() if s.startswith("@") else f"@{s.lower()}"
+
+
+# an @nickname or a t.me link, matched in a single pass over the text
+NICKNAME_RE = re.compile(r"@([A-Za-z\d_]{5,32})|https://t\.me/([A-Za-z\d_]{5,32})")
 
 
 def get_nicknames(text: str) -> set[str]:
     if not text:
         return set()
 
-    at_signs = re.findall(r"@[A-Za-z\d_]{5,32}", text)
-    links = re.findall(r"https://t\.me/([A-Za-z\d_]{5,32})", text)
-
     # TODO: игнорируются ссылки доменного типа и пригласительные ссылки, нужно добавить
 
-    return ensure_ats(at_signs) | ensure_ats(links)
-
+    return {
+        f"@{(at_sign or link).lower()}" for at_sign, link in NICKNAME_RE.findall(text)
+    }
 
-def parse_telegram_message_url(url: str) -> (str, int):
-    # Vaild format:
-    # t.me/<username>/<thread_id>/<id>
-    # t.me/<username>/<id>
-    # t.me/c/<channel>/<id>
-    # t.me/c/<channel>/<thread_id>/<id>
-    # or the above, but starting with https://
 
-    if url.startswith("https://"):
-        url = url[8:]
+# Vaild format:
+# t.me/<username>/<thread_id>/<id>
+# t.me/<username>/<id>
+# t.me/c/<channel>/<id>
+# t.me/c/<channel>/<thread_id>/<id>
+# or the above, but starting with https://
+TELEGRAM_MESSAGE_URL_RE = re.compile(
+    r"^(?:https://)?t\.me/(?:(?:c/)?([^/]*)(?:/[^/]*)?/)?([^/]*)$"
+)
 
-    parts = url.split("/")
 
-    assert parts[0] == "t.me", "Should start with t.me/ or https://t.me/"
+@functools.lru_cache(maxsize=4096)
+def parse_telegram_message_url(url: str) -> (str, int):
+    match = TELEGRAM_MESSAGE_URL_RE.match(url)
 
-    if len(parts) > 3:
-        chat_id = parts[2] if parts[1] == "c" else parts[1]
-    else:
-        chat_id = parts[1]
+    assert match, "Should start with t.me/ or https://t.me/"
 
-    message_id = int(parts[-1])
+    chat_id, message_id = match.groups()
+    message_id = int(message_id)
 
     assert chat_id
     assert message_id > 0
 
     return chat_id, message_id
 
+
+def fast_event_loop_factory() -> Callable[[], asyncio.AbstractEventLoop] | None:
+    """
+    Returns a factory of uvloop (winloop on Windows) event loops if it is
+    installed, or None, which makes asyncio use its default loop.
+
+    Examples:
+        >>> with asyncio.Runner(loop_factory=fast_event_loop_factory()) as runner:
+        ...     runner.run(main())
+    """
+    try:
+        if sys.platform == "win32":
+            import winloop as loop_module
+        else:
+            import uvloop as loop_module
+    except ImportError:
+        return None
+
+    return loop_module.new_event_loop
+
+
 class AbstractFileSystemProtocol(Protocol):
     def glob(self, path: str) -> list[str]:
         pass
@@ -74,5 +101,7 @@ class AbstractFileSystemProtocol(Protocol):
         pass
 
 class TQDMProtocol(Protocol):
+    postfix: str
+
     def set_postfix_str(self, postfix: str) -> None:
         pass